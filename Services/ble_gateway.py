@@ -4,6 +4,7 @@
 import base64
 import os
 import json
+import queue
 import threading
 import time
 import signal
@@ -11,6 +12,7 @@ import sys
 import uuid
 import shutil
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 
@@ -32,6 +34,12 @@ except ImportError as e:
     print(f"[ERROR] MQTT library not available: {e}")
     sys.exit(1)
 
+# pybase64가 설치되어 있으면 NEON SIMD 디코더 사용 (없으면 stdlib 그대로)
+try:
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    _b64decode = base64.b64decode
+
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_CLIENT_ID = "ble-gateway"
@@ -47,8 +55,16 @@ _agent_path = '/ambient/agent'
 _chunk_buffer = []
 _expected_total = 0
 
+# 알림 전용 큐: paho 네트워크 스레드에서 BLE set_value를 직접 부르지 않도록 분리
+# (버스트 시 브로커 수신 루프가 D-Bus 왕복에 막히는 것을 방지, 가득 차면 오래된 것 폐기)
+_notify_q = queue.Queue(maxsize=64)
+
 USER_IMAGES_DIR = "/var/lib/ambient-node/users"
 
+# 메시지 단위 디버그 출력 게이트 (BLE_VERBOSE=1 로 켬)
+# 알림/청크마다 f-string 포맷 + stdout flush 비용을 기본값에서 제거
+VERBOSE = int(os.environ.get("BLE_VERBOSE", "0"))
+
 class PairingAgent(dbus.service.Object):
     def __init__(self, bus):
         super().__init__(bus, _agent_path)
@@ -70,17 +86,25 @@ def register_pairing_agent():
     manager.RequestDefaultAgent(_agent_path)
     return agent
 
+# 이미 만든 디렉토리 기록 (저장마다 stat/mkdir 시스콜 반복 방지)
+_seen_dirs = set()
+
+# 이미지 디코드/저장 전용 워커 (BLE write 콜백 스레드를 수 KB base64 처리로
+# 막지 않음; worker 1개라 등록/수정 처리 순서는 유지됨)
+_io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ble-io')
+
 def save_base64_image_to_png(base64_str: str, save_dir: str, filename: str) -> str:
-    if not os.path.exists(save_dir):
+    if save_dir not in _seen_dirs:
         try:
             os.makedirs(save_dir, exist_ok=True)
+            _seen_dirs.add(save_dir)
         except Exception as e:
             print(f"[IMAGE] Failed to create directory {save_dir}: {e}")
             return ""
     try:
         missing_padding = len(base64_str) % 4
         if missing_padding: base64_str += '=' * (4 - missing_padding)
-        img_data = base64.b64decode(base64_str)
+        img_data = _b64decode(base64_str)
         try:
             img = Image.open(io.BytesIO(img_data))
             img.verify()
@@ -95,6 +119,12 @@ def save_base64_image_to_png(base64_str: str, save_dir: str, filename: str) -> s
 def on_mqtt_connect(client, userdata, flags, reason_code, properties):
     if reason_code == 0:
         print(f'[MQTT] Connected')
+        # Nagle 비활성화 (소형 브릿지 패킷 즉시 송신)
+        try:
+            import socket as _socket
+            client.socket().setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
         client.subscribe("ambient/user/register-ack")
         client.subscribe("ambient/session/active")
         client.subscribe("ambient/stats/response")
@@ -103,26 +133,49 @@ def on_mqtt_connect(client, userdata, flags, reason_code, properties):
 
 def on_mqtt_message(client, userdata, msg):
     try:
+        if msg.topic == "ambient/stats/response":
+            # 게이트웨이가 내용을 보지 않는 토픽은 파싱/재직렬화 없이
+            # 원본 바이트를 그대로 전달 (발행 측이 이미 유효한 JSON)
+            if _notify_char:
+                _enqueue_notification(msg.payload)
+            return
+
         payload = json.loads(msg.payload.decode())
         if msg.topic == "ambient/ai/face-detected":
-            send_notification({"type": "FACE_DETECTED", "user_id": payload.get('user_id')})
+            # 고정 구조 알림은 dict 생성/직렬화 없이 바이트 템플릿으로 조립
+            _enqueue_notification(
+                b'{"type":"FACE_DETECTED","user_id":'
+                + json.dumps(payload.get('user_id')).encode() + b'}')
         elif msg.topic == "ambient/session/active":
              send_notification({"type": "SESSION_UPDATE", "session_id": payload.get('session_id'), "user_list": payload.get('user_list')})
-        elif msg.topic == "ambient/stats/response":
-            send_notification(payload)
     except Exception as e:
         print(f"[MQTT] Msg error: {e}")
 
-def send_notification(data: dict):
-    global _notify_char
-    if _notify_char and data:
+def _notify_worker():
+    while True:
+        payload = _notify_q.get()
         try:
-            payload = json.dumps(data)
-            _notify_char.set_value(payload.encode('utf-8'))
-            print(f'[BLE] Notification sent: {payload}')
+            _notify_char.set_value(payload)
+            if VERBOSE: print(f'[BLE] Notification sent: {len(payload)} bytes')
         except Exception as e:
             print(f"[BLE] Notify error: {e}")
 
+def send_notification(data: dict):
+    global _notify_char
+    if _notify_char and data:
+        payload = json.dumps(data).encode('utf-8')
+        _enqueue_notification(payload)
+
+def _enqueue_notification(payload: bytes):
+    try:
+        _notify_q.put_nowait(payload)
+    except queue.Full:
+        # 최신 상태가 의미 있으므로 drop-oldest
+        try: _notify_q.get_nowait()
+        except queue.Empty: pass
+        try: _notify_q.put_nowait(payload)
+        except queue.Full: pass
+
 def extract_user_id(payload: dict) -> str:
     if 'user_id' in payload and payload['user_id']:
         return payload['user_id']
@@ -149,158 +202,177 @@ def send_ack(action, user_id=None, success=True, error=None, extra_data=None):
         
     send_notification(payload)
 
-def process_complete_data(data_str):
-    global _mqtt_client
-
-    try:
-        payload = json.loads(data_str)
-    except json.JSONDecodeError as e:
-        print(f'[WARN] JSON parse error: {e}')
-        send_notification({"type": "ERROR", "message": "Invalid JSON"})
-        return
+def _act_user_register(payload, user_id, timestamp):
+    register_user_id = payload.get('user_id')
+    username = payload.get('username', 'Unknown')
+    base64_img = payload.get('image_base64')
 
-    timestamp = datetime.now().isoformat()
-    action = payload.get('action', '')
-    
-    user_id = extract_user_id(payload)
-    
-    topic = None
-    mqtt_payload = {}
+    print(f'[BLE] Registering: {username} ({register_user_id})')
+    _io_pool.submit(_register_job, register_user_id, username, base64_img, timestamp)
+    return None
 
-    if action == 'user_register':
-        register_user_id = payload.get('user_id')
-        username = payload.get('username', 'Unknown')
-        base64_img = payload.get('image_base64')
-        
-        print(f'[BLE] Registering: {username} ({register_user_id})')
-        
+def _register_job(register_user_id, username, base64_img, timestamp):
+    # 워커에서 실행되므로 예외를 여기서 잡아 실패 ACK까지 보냄
+    # (Future를 버리는 구조라 여기서 안 잡으면 조용히 사라짐)
+    try:
         image_path = ""
         if base64_img:
             user_dir = os.path.join(USER_IMAGES_DIR, register_user_id)
             filename = f"{register_user_id}.png"
             image_path = save_base64_image_to_png(base64_img, user_dir, filename)
-        
-        topic = "ambient/user/register"
-        mqtt_payload = {
+
+        send_ack("user_register", user_id=register_user_id, success=True)
+        _publish_mqtt("ambient/user/register", {
             "user_id": register_user_id,
             "username": username,
             "image_path": image_path,
             "timestamp": timestamp
-        }
-        
-        send_ack("user_register", user_id=register_user_id, success=True)
+        })
+    except Exception as e:
+        print(f'[BLE] Register job failed: {e}')
+        send_ack("user_register", user_id=register_user_id, success=False, error=str(e))
 
-    elif action == 'user_delete':
-        if user_id:
-            print(f'[BLE] Deleting user: {user_id}')
-            user_dir = os.path.join(USER_IMAGES_DIR, user_id)
-            
-            try:
-                if os.path.exists(user_dir):
-                    shutil.rmtree(user_dir)
-                    print(f'[BLE] Directory deleted: {user_dir}')
-                
-                topic = "ambient/user/delete"
-                mqtt_payload = {
-                    "user_id": user_id,
-                    "timestamp": timestamp
-                }
-                
-                send_ack("user_delete", user_id=user_id, success=True)
-                
-            except Exception as e:
-                print(f'[BLE] Delete failed: {e}')
-                send_ack("user_delete", user_id=user_id, success=False, error=str(e))
-                return
-        else:
-            print('[WARN] User delete missing user_id')
-            return
+def _act_user_delete(payload, user_id, timestamp):
+    if not user_id:
+        print('[WARN] User delete missing user_id')
+        return None
 
-    elif action == 'user_update':
-        username = payload.get('username', 'Unknown')
-        base64_img = payload.get('image_base64')
-        print(f'[BLE] Processing update for: {username} ({user_id})')
-        
+    print(f'[BLE] Deleting user: {user_id}')
+    user_dir = os.path.join(USER_IMAGES_DIR, user_id)
+
+    try:
+        if os.path.exists(user_dir):
+            shutil.rmtree(user_dir)
+            # mkdir 생략 캐시에서도 제거 (삭제 후 재등록 시 다시 만들어야 함)
+            _seen_dirs.discard(user_dir)
+            print(f'[BLE] Directory deleted: {user_dir}')
+
+        send_ack("user_delete", user_id=user_id, success=True)
+        return "ambient/user/delete", {"user_id": user_id, "timestamp": timestamp}
+
+    except Exception as e:
+        print(f'[BLE] Delete failed: {e}')
+        send_ack("user_delete", user_id=user_id, success=False, error=str(e))
+        return None
+
+def _act_user_update(payload, user_id, timestamp):
+    username = payload.get('username', 'Unknown')
+    base64_img = payload.get('image_base64')
+    print(f'[BLE] Processing update for: {username} ({user_id})')
+    _io_pool.submit(_update_job, user_id, username, base64_img, timestamp)
+    return None
+
+def _update_job(user_id, username, base64_img, timestamp):
+    try:
         image_path = ""
         if base64_img and user_id:
             user_dir = os.path.join(USER_IMAGES_DIR, user_id)
             filename = f"{user_id}.png"
             image_path = save_base64_image_to_png(base64_img, user_dir, filename)
-        
-        topic = "ambient/user/update"
-        mqtt_payload = {
+
+        _publish_mqtt("ambient/user/update", {
             "user_id": user_id,
             "username": username,
             "image_path": image_path,
             "timestamp": timestamp
-        }
-
-    elif action == 'mode_change':
-        mode = payload.get('mode', 'manual_control')
-        cmd_type = payload.get('type', 'motor')
-        topic = "ambient/command/mode"
-        mqtt_payload = {"event_type": "mode_change", "type": cmd_type, "mode": mode, "user_id": user_id, "timestamp": timestamp}
-        send_ack("mode_change", user_id, True)
-
-    elif action == 'speed_change':
-        speed = payload.get('speed', 0)
-        topic = "ambient/command/speed"
-        mqtt_payload = {"event_type": "speed_change", "speed": speed, "user_id": user_id, "timestamp": timestamp}
-        send_ack("speed_change", user_id, True)
-
-    elif action == 'direction_change':
-        direction = payload.get('direction', 'center')
-        toggle_on = payload.get('toggleOn', 0)
-        topic = "ambient/command/direction"
-        mqtt_payload = {"event_type": "direction_change", "direction": direction, "toggleOn": toggle_on, "user_id": user_id, "timestamp": timestamp}
-        send_ack("direction_change", user_id, True)
-        
-    elif action == 'timer':
-        duration_sec = payload.get('duration_sec', 0)
-        
-        topic = "ambient/command/timer"
-        mqtt_payload = {
-            "event_type": "timer",
-            "duration_sec": duration_sec,
-            "user_id": user_id,
-            "timestamp": timestamp
-        }
-        server_now = datetime.now()
-        end_time_str = ""
-        
-        if duration_sec > 0:
-            end_time = server_now + timedelta(seconds=duration_sec)
-            end_time_str = end_time.isoformat()
-        
-        print(f'[BLE] Timer set: {duration_sec}s (End: {end_time_str})')
-        
-        send_ack("timer", user_id, True, extra_data={
-            "server_time": server_now.isoformat(),
-            "end_time": end_time_str,
-            "duration_sec": duration_sec
         })
+    except Exception as e:
+        print(f'[BLE] Update job failed: {e}')
+        send_notification({"type": "ERROR", "message": str(e)})
 
-    elif action == 'user_select':
-        user_list = payload.get('user_list', [])
-        topic = "ambient/user/select"
-        mqtt_payload = {"event_type": "user_select", "user_list": user_list, "timestamp": timestamp}
-        send_ack("user_select", user_id, True)
-        
-    elif action == 'shutdown':
-        os.system('sudo shutdown -h now')
-        return
+def _act_mode_change(payload, user_id, timestamp):
+    mode = payload.get('mode', 'manual_control')
+    cmd_type = payload.get('type', 'motor')
+    send_ack("mode_change", user_id, True)
+    return "ambient/command/mode", {"event_type": "mode_change", "type": cmd_type, "mode": mode, "user_id": user_id, "timestamp": timestamp}
+
+def _act_speed_change(payload, user_id, timestamp):
+    speed = payload.get('speed', 0)
+    send_ack("speed_change", user_id, True)
+    return "ambient/command/speed", {"event_type": "speed_change", "speed": speed, "user_id": user_id, "timestamp": timestamp}
+
+def _act_direction_change(payload, user_id, timestamp):
+    direction = payload.get('direction', 'center')
+    toggle_on = payload.get('toggleOn', 0)
+    send_ack("direction_change", user_id, True)
+    return "ambient/command/direction", {"event_type": "direction_change", "direction": direction, "toggleOn": toggle_on, "user_id": user_id, "timestamp": timestamp}
+
+def _act_timer(payload, user_id, timestamp):
+    duration_sec = payload.get('duration_sec', 0)
+
+    mqtt_payload = {
+        "event_type": "timer",
+        "duration_sec": duration_sec,
+        "user_id": user_id,
+        "timestamp": timestamp
+    }
+    server_now = datetime.now()
+    end_time_str = ""
 
-    elif action == 'mqtt_publish':
-        topic = payload.get('topic')
-        mqtt_payload = payload.get('payload')
+    if duration_sec > 0:
+        end_time = server_now + timedelta(seconds=duration_sec)
+        end_time_str = end_time.isoformat()
 
-    else:
-        print(f'[WARN] Unknown action: {action}')
-        return
+    print(f'[BLE] Timer set: {duration_sec}s (End: {end_time_str})')
+
+    send_ack("timer", user_id, True, extra_data={
+        "server_time": server_now.isoformat(),
+        "end_time": end_time_str,
+        "duration_sec": duration_sec
+    })
+    return "ambient/command/timer", mqtt_payload
 
+def _act_user_select(payload, user_id, timestamp):
+    user_list = payload.get('user_list', [])
+    send_ack("user_select", user_id, True)
+    return "ambient/user/select", {"event_type": "user_select", "user_list": user_list, "timestamp": timestamp}
+
+def _act_shutdown(payload, user_id, timestamp):
+    os.system('sudo shutdown -h now')
+    return None
+
+def _act_mqtt_publish(payload, user_id, timestamp):
+    return payload.get('topic'), payload.get('payload')
+
+# action -> 핸들러 점프 테이블 (BLE write마다 문자열 비교 체인 대신 해시 1회)
+_ACTION_HANDLERS = {
+    'user_register': _act_user_register,
+    'user_delete': _act_user_delete,
+    'user_update': _act_user_update,
+    'mode_change': _act_mode_change,
+    'speed_change': _act_speed_change,
+    'direction_change': _act_direction_change,
+    'timer': _act_timer,
+    'user_select': _act_user_select,
+    'shutdown': _act_shutdown,
+    'mqtt_publish': _act_mqtt_publish,
+}
+
+def _publish_mqtt(topic, mqtt_payload):
     if _mqtt_client and _mqtt_client.is_connected() and topic:
         _mqtt_client.publish(topic, json.dumps(mqtt_payload), qos=1)
-        print(f'[MQTT] Published to {topic}')
+        if VERBOSE: print(f'[MQTT] Published to {topic}')
+
+def process_complete_data(data_str):
+    global _mqtt_client
+
+    try:
+        payload = json.loads(data_str)
+    except json.JSONDecodeError as e:
+        print(f'[WARN] JSON parse error: {e}')
+        send_notification({"type": "ERROR", "message": "Invalid JSON"})
+        return
+
+    handler = _ACTION_HANDLERS.get(payload.get('action', ''))
+    if handler is None:
+        print(f"[WARN] Unknown action: {payload.get('action', '')}")
+        return
+
+    result = handler(payload, extract_user_id(payload), datetime.now().isoformat())
+    if result is None:
+        return
+    topic, mqtt_payload = result
+    _publish_mqtt(topic, mqtt_payload)
 
 def on_write_characteristic(value, options):
     global _chunk_buffer, _expected_total
@@ -316,7 +388,7 @@ def on_write_characteristic(value, options):
 
                 if header_content == 'END':
                     if _chunk_buffer and all(_chunk_buffer):
-                        print(f'[BLE] End signal. Assembling {_expected_total} chunks...')
+                        if VERBOSE: print(f'[BLE] End signal. Assembling {_expected_total} chunks...')
                         complete_data = ''.join(_chunk_buffer)
                         _chunk_buffer = []
                         _expected_total = 0
@@ -336,7 +408,7 @@ def on_write_characteristic(value, options):
                         _chunk_buffer[current_idx] = chunk_data
 
                     if all(_chunk_buffer):
-                        print(f'[BLE] All chunks assembled (Auto).')
+                        if VERBOSE: print(f'[BLE] All chunks assembled (Auto).')
                         complete_data = ''.join(_chunk_buffer)
                         _chunk_buffer = []
                         _expected_total = 0
@@ -393,6 +465,7 @@ def main():
     _mqtt_client.on_message = on_mqtt_message
     _mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
     _mqtt_client.loop_start()
+    threading.Thread(target=_notify_worker, daemon=True).start()
     try:
         ad_manager, advert, gatt_manager, app = setup_gatt_and_advertising()
         GLib.MainLoop().run()
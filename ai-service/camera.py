@@ -1,111 +1,235 @@
 import cv2
 import numpy as np
+import os
 import socket
-import threading
 import time
-from collections import deque # 앞,뒤로 데이터를 넣고 빼는 속도가 엄청 빠른 queue
+import multiprocessing
+from multiprocessing import shared_memory
 
 
 class CameraStream:
+    """TCP 카메라 수신을 별도 프로세스로 분리 (SharedMemory 링버퍼 전달)
+
+    수신/디코딩(YUV->RGB)이 AI 코어와 다른 프로세스에서 돌고,
+    프레임은 공유 메모리 슬롯에 직접 기록되므로 프로세스 간
+    pickle/큐 복사(1080p 기준 프레임당 약 6MB)가 사라진다.
+
+    프레임은 RGB로 디코딩된다. MediaPipe가 RGB 입력을 원하므로
+    소비 측의 BGR->RGB 변환 패스가 통째로 불필요해진다.
+
+    감지용 다운스케일(DETECT_WIDTH x DETECT_HEIGHT)도 수신 프로세스에서
+    같이 수행해 원본/축소 프레임 쌍을 기록한다. AI 루프는 전처리 패스가 0개가 됨.
+    """
+
+    NUM_SLOTS = 3  # 링버퍼 슬롯 수 (쓰기 중인 슬롯을 읽지 않도록 여유 확보)
+
     def __init__(self, config):
         self.config = config
-        self.frame_queue = deque(maxlen=1) # 큐의 크기를 1개로 제한해서 새 데이터가 들어오면 옛날 데이터는 자동으로 밀려남.
-        self.lock = threading.Lock() # 여러 쓰레드가 동시에 데이터에 손대지 못하게 막는 자물쇠. 잠깐 문을 잠글 때 씀.
-        self.running = False
+        self.frame_shape = (config.CAMERA_HEIGHT, config.CAMERA_WIDTH, 3)
+        self.frame_bytes = config.CAMERA_HEIGHT * config.CAMERA_WIDTH * 3
+        self.small_shape = (config.DETECT_HEIGHT, config.DETECT_WIDTH, 3)
+        self.small_bytes = config.DETECT_HEIGHT * config.DETECT_WIDTH * 3
+        self.shm = None
+        self.shm_small = None
+        self.process = None
+        # 쓰기 카운터: 지금까지 완성된 프레임 수 (0 = 아직 없음)
+        self.write_counter = multiprocessing.Value('Q', 0)
+        self.counter_lock = multiprocessing.Lock()
+        # 새 프레임 도착 알림 (소비자의 1ms 폴링 제거)
+        self.new_frame = multiprocessing.Event()
 
 
     def start(self):
-        """카메라 스트림 시작"""
+        """카메라 스트림 시작 (수신 프로세스 fork)"""
         print(f"[Camera] Using external rpicam-vid at tcp://{self.config.TCP_IP}:{self.config.TCP_PORT}")
-        self.running = True
-        threading.Thread(target=self._receive_stream, daemon=True).start() # _receive_stream 스레드 생성해서 메인 프로그램에서 제외함.
-
-
-    def _receive_stream(self):
-        """TCP 스트림 수신 (최적화), 영상 수신 함수"""
-        max_retries = 10
-        retry_delay = 3
-        
-        for attempt in range(max_retries): # 접속 시도 반복문
-            try:
-                # 1. 소켓(전화기) 만들기. AF_INET(인터넷), SOCK_STREAM(TCP 방식)
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 * 1024 * 1024)  # 2MB 버퍼
-                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 지연 최소화 : 딜레이 없이 바로바로 보내라고 설정. Nagle 알고리즘 끄기
-                
-                sock.settimeout(5) # 5초동안 응답 없으면 끊음
-                
-                # 실제 연결 시도 (IP, PORT)
-                sock.connect((self.config.TCP_IP, self.config.TCP_PORT))
-                print(f"[Camera] Connected to {self.config.TCP_IP}:{self.config.TCP_PORT}")
-                break
-            except (ConnectionRefusedError, socket.timeout) as e:
-                print(f"[Camera] Connection failed (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    print(f"[Camera] Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                else:
-                    print("[Camera] Max retries reached, stream unavailable")
-                    self.running = False
-                    return
-        
-        sock.settimeout(None)  # 블로킹 모드
-        
-        buffer = b""
-        frame_size = self.config.CAMERA_WIDTH * self.config.CAMERA_HEIGHT * 3 // 2  # YUV420 포맷은 RGB의 1.5배 크기
-
-
-        while self.running:
-            try:
-                # 1. 네트워크에서 chunk를 128kb씩 받음.
-                chunk = sock.recv(131072)
-                if not chunk:
-                    print("[Camera] Stream ended")
-                    self.running = False
-                    break
-                
-                buffer += chunk
-                
-                # 버퍼에 한 장의 사진 분량이 모였는지 확인
-                while len(buffer) >= frame_size:
-                    # 딱 한 장 분량만 잘라냄
-                    frame_data = buffer[:frame_size]
-                    # 남은 찌꺼기는 다시 버퍼에 저장함
-                    buffer = buffer[frame_size:]
-                    
-                    try:
-                        # 데이터 변환 - byte -> 숫자 행렬 -> 이미지(YUV)
-                        yuv = np.frombuffer(frame_data, dtype=np.uint8).reshape(
-                            (self.config.CAMERA_HEIGHT * 3 // 2, self.config.CAMERA_WIDTH)
-                        )
-                        
-                        # 색상 변환 YUV -> BGR
-                        bgr = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
-                        
-                        # 완성된 이미지를 큐에 넣음
-                        # with self.lock 은 카메라 쓰레드는
-                        with self.lock:
-                            self.frame_queue.append(bgr)
-                    except Exception:
-                        continue
-            
-            except Exception as e:
-                print(f"[Camera] ❌ Frame receive error: {e}")
-                break
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.NUM_SLOTS * self.frame_bytes
+        )
+        self.shm_small = shared_memory.SharedMemory(
+            create=True, size=self.NUM_SLOTS * self.small_bytes
+        )
+        self.process = multiprocessing.Process(
+            target=_receive_stream,
+            args=(self.config, self.shm.name, self.shm_small.name,
+                  self.write_counter, self.counter_lock, self.new_frame),
+            daemon=True,
+        )
+        self.process.start()
 
 
-        sock.close()
-        print("[Camera] Receiver stopped")
+    def get_frame(self):
+        """가장 최근 완성된 프레임(RGB)의 zero-copy 뷰 반환
 
+        반환값은 공유 메모리 뷰이므로 복사가 없다. 소비자가 프레임을
+        오래(슬롯 순환 주기 이상) 붙들고 있어야 한다면 .copy()를 떠야 함.
+        """
+        if self.shm is None:
+            return None
+        with self.counter_lock:
+            count = self.write_counter.value
+        if count == 0:
+            return None
+        slot = (count - 1) % self.NUM_SLOTS
+        return np.ndarray(
+            self.frame_shape,
+            dtype=np.uint8,
+            buffer=self.shm.buf,
+            offset=slot * self.frame_bytes,
+        )
+
+
+    def wait_for_frame(self, timeout=0.5):
+        """새 프레임 도착까지 이벤트 대기 (busy-wait 없음)
+
+        도착하면 True, 타임아웃이면 False.
+        """
+        if self.new_frame.wait(timeout):
+            self.new_frame.clear()
+            return True
+        return False
 
-    def get_frame(self):
-        """가장 최근 프레임 반환 (복사 없음)"""
-        with self.lock:
-            if self.frame_queue:
-                return self.frame_queue[-1]
-        return None
+
+    def get_frame_pair(self):
+        """(원본 FHD, 감지용 축소) 프레임 뷰 쌍 반환 (둘 다 zero-copy)"""
+        if self.shm is None:
+            return None, None
+        with self.counter_lock:
+            count = self.write_counter.value
+        if count == 0:
+            return None, None
+        slot = (count - 1) % self.NUM_SLOTS
+        frame = np.ndarray(
+            self.frame_shape,
+            dtype=np.uint8,
+            buffer=self.shm.buf,
+            offset=slot * self.frame_bytes,
+        )
+        frame_small = np.ndarray(
+            self.small_shape,
+            dtype=np.uint8,
+            buffer=self.shm_small.buf,
+            offset=slot * self.small_bytes,
+        )
+        return frame, frame_small
 
 
     def stop(self):
-        self.running = False
+        if self.process:
+            self.process.terminate()
+            self.process.join(timeout=2)
+            self.process = None
+        for name in ('shm', 'shm_small'):
+            shm = getattr(self, name)
+            if shm:
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+                setattr(self, name, None)
+
+
+def _receive_stream(config, shm_name, shm_small_name, write_counter, counter_lock, new_frame):
+    """TCP 스트림 수신 프로세스 (공유 메모리 슬롯에 직접 기록)"""
+    # 수신/디코딩을 전용 코어에 고정 (AI 코어와 경합 방지, 실패해도 무방)
+    try:
+        os.sched_setaffinity(0, {2})
+    except (AttributeError, OSError):
+        pass
+
+    max_retries = 10
+    retry_delay = 3
+
+    for attempt in range(max_retries):  # 접속 시도 반복문
+        try:
+            # 1. 소켓(전화기) 만들기. AF_INET(인터넷), SOCK_STREAM(TCP 방식)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 * 1024 * 1024)  # 2MB 버퍼
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 지연 최소화 : 딜레이 없이 바로바로 보내라고 설정. Nagle 알고리즘 끄기
+
+            sock.settimeout(5)  # 5초동안 응답 없으면 끊음
+
+            # 실제 연결 시도 (IP, PORT)
+            sock.connect((config.TCP_IP, config.TCP_PORT))
+            print(f"[Camera] Connected to {config.TCP_IP}:{config.TCP_PORT}")
+            break
+        except (ConnectionRefusedError, socket.timeout) as e:
+            print(f"[Camera] Connection failed (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                print(f"[Camera] Retrying in {retry_delay}s...")
+                time.sleep(retry_delay)
+            else:
+                print("[Camera] Max retries reached, stream unavailable")
+                return
+
+    sock.settimeout(None)  # 블로킹 모드
+
+    # 공유 메모리 링버퍼를 numpy 뷰로 매핑
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame_shape = (config.CAMERA_HEIGHT, config.CAMERA_WIDTH, 3)
+    frame_bytes = config.CAMERA_HEIGHT * config.CAMERA_WIDTH * 3
+    slots = [
+        np.ndarray(frame_shape, dtype=np.uint8, buffer=shm.buf, offset=i * frame_bytes)
+        for i in range(CameraStream.NUM_SLOTS)
+    ]
+    shm_small = shared_memory.SharedMemory(name=shm_small_name)
+    small_shape = (config.DETECT_HEIGHT, config.DETECT_WIDTH, 3)
+    small_bytes = config.DETECT_HEIGHT * config.DETECT_WIDTH * 3
+    small_slots = [
+        np.ndarray(small_shape, dtype=np.uint8, buffer=shm_small.buf, offset=i * small_bytes)
+        for i in range(CameraStream.NUM_SLOTS)
+    ]
+
+    buffer = b""
+    frame_size = config.CAMERA_WIDTH * config.CAMERA_HEIGHT * 3 // 2  # YUV420 포맷은 RGB의 1.5배 크기
+
+    try:
+        while True:
+            # 1. 네트워크에서 chunk를 128kb씩 받음.
+            chunk = sock.recv(131072)
+            if not chunk:
+                print("[Camera] Stream ended")
+                break
+
+            buffer += chunk
+
+            # 버퍼에 한 장의 사진 분량이 모였는지 확인
+            while len(buffer) >= frame_size:
+                # 딱 한 장 분량만 잘라냄
+                frame_data = buffer[:frame_size]
+                # 남은 찌꺼기는 다시 버퍼에 저장함
+                buffer = buffer[frame_size:]
+
+                try:
+                    # 데이터 변환 - byte -> 숫자 행렬 -> 이미지(YUV)
+                    yuv = np.frombuffer(frame_data, dtype=np.uint8).reshape(
+                        (config.CAMERA_HEIGHT * 3 // 2, config.CAMERA_WIDTH)
+                    )
+
+                    # 다음 슬롯에 YUV -> RGB 변환 결과를 바로 기록 (중간 버퍼 없음)
+                    slot = write_counter.value % CameraStream.NUM_SLOTS
+                    cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420, dst=slots[slot])
+
+                    # 감지용 축소본도 같은 슬롯 번호에 기록 (AI 루프의 resize 패스 제거)
+                    # INTER_NEAREST: 감지 입력용 다운스케일은 2x2 블렌딩이 불필요
+                    cv2.resize(
+                        slots[slot],
+                        (config.DETECT_WIDTH, config.DETECT_HEIGHT),
+                        dst=small_slots[slot],
+                        interpolation=cv2.INTER_NEAREST,
+                    )
+
+                    # 기록 완료 후 카운터 증가 -> 소비자에게 공개 (쌍이 함께 공개됨)
+                    with counter_lock:
+                        write_counter.value += 1
+                    new_frame.set()
+                except Exception:
+                    continue
+    except Exception as e:
+        print(f"[Camera] ❌ Frame receive error: {e}")
+    finally:
+        sock.close()
+        shm.close()
+        shm_small.close()
+        print("[Camera] Receiver stopped")
@@ -9,6 +9,11 @@ class Config:
     CAMERA_HEIGHT = 1080
     PROCESSING_WIDTH = 640
     PROCESSING_HEIGHT = 360
+
+    # MediaPipe 감지 입력 해상도 (검출 비용은 해상도에 제곱 비례 ->
+    # 320으로 내리고 상대좌표 그대로 원본 해상도로 역투영)
+    DETECT_WIDTH = 320
+    DETECT_HEIGHT = 180
                         
     MQTT_SEND_INTERVAL = 1.0 / 6.0 # 1초에 6번 보내게 수정함
     FACE_ID_INTERVAL = 0.5
@@ -17,6 +22,13 @@ class Config:
     MIN_FACE_SIZE = 0
     
     SIMILARITY_THRESHOLD = 0.7
+
+    # 모션 게이트: 장면 변화가 적으면 감지 스킵 (32x32 그레이 diff 합 기준)
+    MOTION_GATE_THRESH = 15000
+    MOTION_MAX_SKIP = 5
+
+    # ROI 감지: 추적 중에는 얼굴 주변만 감지하고 K프레임마다 전체 재탐색
+    ROI_REDETECT_INTERVAL = 30
     
     SAVE_DIR = os.getenv('SAVE_DIR', '/var/lib/ambient-node/captures')
     FACE_DIR = os.getenv('FACE_DIR', '/var/lib/ambient-node/users')
@@ -2,6 +2,8 @@
 import os
 import cv2
 import json
+import hashlib
+from collections import OrderedDict
 import numpy as np
 from tflite_runtime.interpreter import Interpreter
 
@@ -11,7 +13,13 @@ class FaceRecognizer:
         self.threshold = similarity_threshold 
         self.known_embeddings = []
         self.known_user_ids = []
-        
+        # (N,D) float32 연속 행렬 - 유사도 계산이 BLAS(NEON) gemv 한 번으로 끝남
+        self.known_matrix = None
+        # dHash -> (user_id, conf) 결과 캐시: 정지 상태 얼굴은 크롭이 거의
+        # 동일하므로 인코더 forward 자체를 생략 (최대 256건 LRU)
+        self._dhash_cache = OrderedDict()
+        self._dhash_buf = np.empty((8, 9), dtype=np.uint8)
+
         self.interpreter = Interpreter(model_path=model_path)
         self.interpreter.allocate_tensors()
         self.input_details = self.interpreter.get_input_details()
@@ -30,6 +38,11 @@ class FaceRecognizer:
         if not user_ids:
             self.known_embeddings = []
             self.known_user_ids = []
+            # 대상이 없으면 행렬도 비움 (이전 세션 행렬로 계속 매칭되는 것 방지)
+            self.known_matrix = None
+            # 캐시된 매칭 결과도 이전 대상 기준이므로 함께 무효화
+            self._dhash_cache.clear()
+            print("[FaceRec] Loaded Users: 0")
             return
         
         for user_id in user_ids:
@@ -38,6 +51,7 @@ class FaceRecognizer:
             
             if os.path.exists(emb_file):
                 try:
+                    self._migrate_legacy_embedding(user_id, user_path, emb_file)
                     emb = np.load(emb_file)
                     norm = np.linalg.norm(emb)
                     if norm > 0:
@@ -49,8 +63,39 @@ class FaceRecognizer:
 
         self.known_embeddings = temp_embeddings
         self.known_user_ids = temp_user_ids
+        # 로드 시점에 한 번만 행렬로 적층 (recognize마다 리스트->배열 변환 방지)
+        if temp_embeddings:
+            self.known_matrix = np.ascontiguousarray(
+                np.stack(temp_embeddings).astype(np.float32))
+        else:
+            self.known_matrix = None
+        # 대상 집합이 바뀌면 캐시된 매칭 결과는 무효
+        self._dhash_cache.clear()
         print(f"[FaceRec] Loaded Users: {len(self.known_user_ids)}")
 
+    def _migrate_legacy_embedding(self, user_id, user_path, emb_file):
+        """BGR 시절 임베딩 마이그레이션
+
+        등록 경로가 RGB로 바뀌기 전에 저장된 embedding.npy는 BGR 기준이라
+        라이브(RGB) 크롭과 맞지 않음. image_sha1이 없는 메타는 그 시절
+        산출물이므로 보관된 원본 이미지로 1회 재계산함 (이후 sha1이 기록되어
+        다시 수행되지 않음).
+        """
+        meta_file = os.path.join(user_path, "metadata.json")
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+        except Exception:
+            return
+        if 'image_sha1' in meta:
+            return
+
+        image_path = os.path.join(user_path, f"{user_id}.png")
+        if not os.path.exists(image_path):
+            return
+        print(f"[FaceRec] Migrating legacy (BGR) embedding: {user_id}")
+        self.register_user(user_id, meta.get('username', 'Unknown'), image_path)
+
     def get_embedding(self, face_img):
         """이미지 -> 정규화된 임베딩 벡터 변환"""
         if face_img is None or face_img.size == 0:
@@ -74,39 +119,88 @@ class FaceRecognizer:
             print(f"[FaceRec] Embedding Error: {e}")
             return None
 
+    def _crop_dhash(self, face_crop):
+        """8x8 dHash (9x8 그레이 축소 후 인접 픽셀 대소 비교 -> 8바이트 키)"""
+        try:
+            cv2.resize(
+                cv2.cvtColor(face_crop, cv2.COLOR_RGB2GRAY), (9, 8),
+                dst=self._dhash_buf, interpolation=cv2.INTER_AREA)
+            return np.packbits(
+                self._dhash_buf[:, 1:] > self._dhash_buf[:, :-1]).tobytes()
+        except Exception:
+            return None
+
     def recognize(self, face_crop):
         """코사인 유사도 기반 인식"""
-        if not self.known_embeddings:
+        if self.known_matrix is None:
             return None, 0.0
-        
+
+        # 크롭이 직전과 지각적으로 동일하면 임베딩 없이 캐시 결과 반환
+        dhash = self._crop_dhash(face_crop)
+        if dhash is not None:
+            cached = self._dhash_cache.get(dhash)
+            if cached is not None:
+                self._dhash_cache.move_to_end(dhash)
+                return cached
+
         target_embedding = self.get_embedding(face_crop)
-        if target_embedding is None: 
+        if target_embedding is None:
             return None, 0.0
 
-        sims = np.dot(self.known_embeddings, target_embedding)
+        # float32 gemv 한 번 (정규화된 벡터라 dot == 코사인 유사도)
+        sims = self.known_matrix @ target_embedding.astype(np.float32)
         
         best_idx = int(np.argmax(sims))
         best_sim = float(sims[best_idx])
         
         if best_sim > self.threshold:
-            return self.known_user_ids[best_idx], best_sim
-        
-        return None, 0.0
+            result = (self.known_user_ids[best_idx], best_sim)
+        else:
+            result = (None, 0.0)
+
+        if dhash is not None:
+            self._dhash_cache[dhash] = result
+            if len(self._dhash_cache) > 256:
+                self._dhash_cache.popitem(last=False)
+        return result
 
     def register_user(self, user_id, username, image_path):
-        """사용자 등록"""
+        """사용자 등록 (같은 이미지 재등록 시 임베딩 재계산 생략)"""
         try:
+            with open(image_path, 'rb') as f:
+                image_sha1 = hashlib.sha1(f.read()).hexdigest()
+
+            user_dir = os.path.join(self.face_dir, user_id)
+            emb_file = os.path.join(user_dir, "embedding.npy")
+            meta_file = os.path.join(user_dir, "metadata.json")
+
+            # 캐시 히트: 이미지 해시가 같으면 인코더 forward 없이 이름만 갱신
+            if os.path.exists(emb_file) and os.path.exists(meta_file):
+                try:
+                    with open(meta_file) as f:
+                        meta = json.load(f)
+                    if meta.get('image_sha1') == image_sha1:
+                        if meta.get('username') != username:
+                            meta['username'] = username
+                            with open(meta_file, 'w') as f:
+                                json.dump(meta, f)
+                        print(f"[FaceRec] Embedding cache hit: {user_id}")
+                        return True
+                except Exception:
+                    pass
+
             img = cv2.imread(image_path)
             if img is None: return False
-            
+            # 라이브 프레임이 RGB이므로 등록 이미지도 RGB로 맞춤 (채널 순서 일치)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
             embedding = self.get_embedding(img)
             if embedding is None: return False
-            
-            user_dir = os.path.join(self.face_dir, user_id)
+
             os.makedirs(user_dir, exist_ok=True)
-            np.save(os.path.join(user_dir, "embedding.npy"), embedding)
-            
-            with open(os.path.join(user_dir, "metadata.json"), 'w') as f:
-                json.dump({"user_id": user_id, "username": username}, f)
+            np.save(emb_file, embedding)
+
+            with open(meta_file, 'w') as f:
+                json.dump({"user_id": user_id, "username": username, "image_sha1": image_sha1}, f)
             return True
         except Exception: return False
\ No newline at end of file
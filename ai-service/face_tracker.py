@@ -1,13 +1,21 @@
-"""얼굴 추적 관리 (단순 거리 계산 방식 복구)"""
+"""얼굴 추적 관리 (단순 거리 계산 방식 복구)
+
+시각 값은 모두 time.monotonic_ns() 정수 (NTP 점프 영향 없음, float 연산 제거)
+"""
 
 import threading
 
+import numpy as np
+
 class FaceTracker:
+    # 이 신뢰도를 넘으면 신원 잠금 (재임베딩 생략)
+    LOCK_THRESHOLD = 0.9
+
     def __init__(self, max_distance=150, lost_timeout=0.5, enable_display=True):
         self.tracked_faces = {}
         self.next_id = 0
         self.max_distance = max_distance
-        self.lost_timeout = lost_timeout
+        self.lost_timeout_ns = int(lost_timeout * 1e9)
         self.lock = threading.Lock()
             
     def reset(self):
@@ -16,15 +24,34 @@ class FaceTracker:
             self.next_id = 0
 
     def update(self, detected_positions, current_time):
-        """이전 방식: 가장 가까운 트래커 찾기"""
+        """이전 방식: 가장 가까운 트래커 찾기 (거리 행렬은 일괄 계산)"""
         with self.lock:
             updated_ids = set()
-            
-            for pos in detected_positions:
+
+            # (감지 N) x (추적 M) 거리 행렬을 NumPy로 한 번에 계산
+            # -> 파이썬 이중 루프 제거, 매칭 자체는 기존 그리디 유지
+            dists = None
+            tracked_ids = None
+            if detected_positions and self.tracked_faces:
+                tracked_ids = list(self.tracked_faces)
+                centers = np.array(
+                    [self.tracked_faces[fid]['center'] for fid in tracked_ids],
+                    dtype=np.float32)
+                det = np.array(
+                    [pos['center'] for pos in detected_positions],
+                    dtype=np.float32)
+                diff = det[:, None, :] - centers[None, :, :]
+                dists = np.sqrt((diff * diff).sum(axis=-1))
+
+            for i, pos in enumerate(detected_positions):
                 center = pos['center']
-                # 단순 거리 계산 (Greedy)
-                closest_id = self._find_closest(center)
-                
+                # 행에서 최솟값 하나만 꺼내면 기존 _find_closest와 동일
+                closest_id = None
+                if dists is not None:
+                    j = int(np.argmin(dists[i]))
+                    if dists[i, j] < self.max_distance:
+                        closest_id = tracked_ids[j]
+
                 if closest_id is not None:
                     self.tracked_faces[closest_id].update({
                         'center': center,
@@ -38,29 +65,14 @@ class FaceTracker:
                         'center': center,
                         'bbox': pos['bbox'],
                         'last_seen': current_time,
-                        'last_identified': 0.0,
+                        'last_identified': 0,
                     }
                     updated_ids.add(self.next_id)
                     self.next_id += 1
             
-            lost_faces = self._remove_expired(current_time, timeout=self.lost_timeout)
+            lost_faces = self._remove_expired(current_time, timeout=self.lost_timeout_ns)
             return updated_ids, lost_faces
 
-    def _find_closest(self, center):
-        """단순 유클리드 거리 계산"""
-        min_dist = float('inf')
-        closest_id = None
-        
-        for fid, finfo in self.tracked_faces.items():
-            old_center = finfo['center']
-            dist = ((center[0] - old_center[0]) ** 2 +
-                   (center[1] - old_center[1]) ** 2) ** 0.5
-            if dist < min_dist and dist < self.max_distance:
-                min_dist = dist
-                closest_id = fid
-        
-        return closest_id
-
     def _remove_expired(self, current_time, timeout):
         expired = [fid for fid, finfo in self.tracked_faces.items()
                    if current_time - finfo['last_seen'] > timeout]
@@ -77,6 +89,10 @@ class FaceTracker:
             newly_identified = []
             
             for fid, finfo in self.tracked_faces.items():
+                # 고신뢰로 잠긴 얼굴은 잠금 만료까지 재임베딩 생략 (force_all에도 유지)
+                if current_time < finfo.get('id_locked_until', 0):
+                    continue
+
                 if not force_all and current_time - finfo['last_identified'] < interval:
                     continue
                 
@@ -86,7 +102,9 @@ class FaceTracker:
                 x1, y1 = max(0, x1), max(0, y1)
                 x2, y2 = min(w, x2), min(h, y2)
                 
-                face_crop = frame[y1:y2, x1:x2]
+                # frame은 공유메모리 링 슬롯의 뷰 -> 임베딩이 도는 동안 카메라
+                # 프로세스가 같은 슬롯을 덮어쓸 수 있으므로 크롭은 복사해서 사용
+                face_crop = np.ascontiguousarray(frame[y1:y2, x1:x2])
                 if face_crop.size == 0: continue
                 
                 user_id, confidence = recognizer.recognize(face_crop)
@@ -99,15 +117,39 @@ class FaceTracker:
                     finfo['confidence'] = confidence
                     finfo['last_identified'] = current_time
                     if 'first_seen' not in finfo: finfo['first_seen'] = current_time
+
+                    # 신원 잠금: 충분히 확실하면 기본 간격의 10배 후에만 재검증
+                    if confidence > self.LOCK_THRESHOLD:
+                        finfo['id_locked_until'] = current_time + 10 * interval
                     
                     newly_identified.append((fid, user_id, confidence))
             
             return newly_identified
 
-    def get_selected_faces(self, selected_user_ids):
+    def clear_identity_locks(self):
+        """세션 변경 시 잠금 해제 (선택 사용자 집합이 바뀌었을 수 있음)"""
         with self.lock:
-            return [
-                {**finfo, 'face_id': fid}
-                for fid, finfo in self.tracked_faces.items()
-                if finfo.get('user_id') in selected_user_ids
-            ]
\ No newline at end of file
+            for finfo in self.tracked_faces.values():
+                finfo['id_locked_until'] = 0
+
+    def get_bboxes(self):
+        """현재 추적 중인 얼굴 bbox 목록 (FHD 좌표)"""
+        with self.lock:
+            return [finfo['bbox'] for finfo in self.tracked_faces.values()]
+
+    def get_selected_faces(self, selected_user_ids, now=None, max_age_ns=300_000_000):
+        """선택된 사용자의 신선한 얼굴을 user_id 기준으로 반환
+
+        now(monotonic_ns)가 주어지면 max_age_ns보다 오래된 항목(유령 좌표)은
+        여기서 걸러냄 -> 호출 측의 재필터링/dict 재구축 불필요
+        """
+        with self.lock:
+            selected = {}
+            for fid, finfo in self.tracked_faces.items():
+                uid = finfo.get('user_id')
+                if uid not in selected_user_ids:
+                    continue
+                if now is not None and now - finfo['last_seen'] >= max_age_ns:
+                    continue
+                selected[uid] = {**finfo, 'face_id': fid}
+            return selected
\ No newline at end of file
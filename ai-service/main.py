@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """AI Service - 1920x1080 입력 / 180도 회전 / 640 처리"""
 
+import os
 import time
+import queue
+import threading
 import cv2
 import numpy as np
 import mediapipe as mp
@@ -11,38 +14,67 @@ from face_recognition import FaceRecognizer
 from face_tracker import FaceTracker
 from mqtt_client import MQTTClient
 
-# ✅ NMS: 중복 박스 제거
+def set_cpu_affinity(cpus, label):
+    """코어 고정 (권한/플랫폼 문제로 실패해도 동작에는 지장 없음)"""
+    try:
+        os.sched_setaffinity(0, cpus)
+        print(f"[AI] {label}: pinned to CPU {sorted(cpus)}")
+    except (AttributeError, OSError):
+        pass
+
+# ✅ NMS: 중복 박스 제거 (bool 마스크 생존 방식 - np.delete/concatenate 없음)
+# 겹침 비율 기반이라 스케일 불변 -> 정규화(0~1) 좌표 그대로 받음
 def non_max_suppression(boxes, scores, overlap_thresh=0.3):
-    if len(boxes) == 0: return []
-    if boxes.dtype.kind == "i": boxes = boxes.astype("float")
-    
-    pick = []
+    n = len(boxes)
+    if n == 0: return []
+    # float32 유지 (float64 대비 대역폭 절반)
+    boxes = boxes.astype(np.float32, copy=False)
+
     x1 = boxes[:, 0]
     y1 = boxes[:, 1]
     x2 = boxes[:, 2]
     y2 = boxes[:, 3]
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(scores)
+    area = (x2 - x1) * (y2 - y1)
+
+    # 점수 내림차순으로 선택, 탈락자는 마스크에만 표시 (배열 재구축 없음)
+    order = np.argsort(-scores)
+    suppressed = np.zeros(n, dtype=bool)
+    pick = []
+
+    for idx in range(n):
+        i = order[idx]
+        if suppressed[i]: continue
+        pick.append(int(i))
+
+        rest = order[idx + 1:]
+        rest = rest[~suppressed[rest]]
+        if rest.size == 0: continue
+
+        xx1 = np.maximum(x1[i], x1[rest])
+        yy1 = np.maximum(y1[i], y1[rest])
+        xx2 = np.minimum(x2[i], x2[rest])
+        yy2 = np.minimum(y2[i], y2[rest])
+
+        w = np.maximum(0, xx2 - xx1)
+        h = np.maximum(0, yy2 - yy1)
+
+        overlap = (w * h) / (area[rest] + 1e-6)
+        suppressed[rest[overlap > overlap_thresh]] = True
 
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-        
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-        
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-        
-        overlap = (w * h) / area[idxs[:last]]
-        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlap_thresh)[0])))
-    
     return pick
 
 class AIService:
+    # __slots__: 속성 접근을 __dict__ 탐색 대신 고정 슬롯 인덱싱으로
+    __slots__ = (
+        'config', 'camera', 'recognizer', 'tracker', 'mqtt',
+        'face_detection',
+        'current_mode', 'last_position_time', '_proj_fhd',
+        'detect_queue', 'running',
+        '_motion_prev', '_frames_since_detect', '_prev_detected',
+        '_roi_frame_count', '_frame_count', '_detect_count',
+        '_gate_small', '_gate_gray',
+    )
+
     def __init__(self, config):
         self.config = config
         self.camera = CameraStream(config)
@@ -54,6 +86,16 @@ class AIService:
             lost_timeout=config.FACE_LOST_TIMEOUT,
         )
         
+        # MediaPipe 그래프는 서비스 수명 동안 1회만 생성 (모드 토글마다
+        # 재구축하면 그래프 빌드 비용 수십~수백 ms가 반복됨).
+        # 사용은 감지 스레드에 한정 (MediaPipe는 스레드 안전하지 않음)
+        # 감지 설정 (model_selection=1: 원거리/전신용이 1920 해상도에서 더 적합할 수 있음)
+        # 상황에 따라 0으로 변경 가능
+        self.face_detection = mp.solutions.face_detection.FaceDetection(
+            model_selection=1,
+            min_detection_confidence=0.5
+        )
+
         self.mqtt = MQTTClient(config.BROKER, config.PORT)
         self.mqtt.on_session_update = self.on_session_update
         self.mqtt.on_user_register = self.on_user_register
@@ -62,8 +104,31 @@ class AIService:
         
         self.current_mode = "manual_control"
         self.last_position_time = 0
-        
-        print(f"[AI] Init: Input 1920x1080 | Process {config.PROCESSING_WIDTH}x{config.PROCESSING_HEIGHT}")
+
+        # bbox 투영용 스케일 벡터 (상대좌표 -> 화면좌표를 벡터 곱 한 번으로)
+        self._proj_fhd = np.array(
+            [config.CAMERA_WIDTH, config.CAMERA_HEIGHT,
+             config.CAMERA_WIDTH, config.CAMERA_HEIGHT], dtype=np.float32)
+
+        # 파이프라인 큐: 감지 스레드 -> 메인 루프 (크기 1, 오래된 결과는 버림)
+        self.detect_queue = queue.Queue(maxsize=1)
+        self.running = False
+
+        # 모션 게이트 버퍼 사전 할당 (프레임마다 resize/cvtColor 결과 malloc 방지)
+        self._gate_small = np.empty((32, 32, 3), dtype=np.uint8)
+        self._gate_gray = np.empty((32, 32), dtype=np.uint8)
+
+        # 모션 게이트 상태 (감지 스레드 전용)
+        self._motion_prev = None
+        self._frames_since_detect = 0
+        self._prev_detected = []
+        self._roi_frame_count = 0
+
+        # 통계 카운터 (핫루프에서는 증가만, 출력은 리포터 스레드가 담당)
+        self._frame_count = 0
+        self._detect_count = 0
+
+        print(f"[AI] Init: Input 1920x1080 | Detect {config.DETECT_WIDTH}x{config.DETECT_HEIGHT}")
 
     def on_mode_change(self, mode):
         print(f"[AI] Mode: {mode}")
@@ -73,6 +138,8 @@ class AIService:
         
     def on_session_update(self, session_id, user_ids):
         self.recognizer.load_selected_users(user_ids)
+        # 식별 대상이 바뀌었으니 신원 잠금은 무효
+        self.tracker.clear_identity_locks()
 
     def on_user_register(self, payload):
         if payload.get('image_path'):
@@ -83,143 +150,262 @@ class AIService:
         if user_id in self.recognizer.known_usernames:
             self.recognizer.known_usernames[user_id] = payload.get('username')
 
+    def _detect_worker(self):
+        """감지 전용 스레드: 캡처 -> 리사이즈 -> MediaPipe 감지까지만 수행
+
+        MediaPipe는 스레드 안전하지 않으므로 self.face_detection은
+        이 스레드 안에서만 사용한다 (생성은 __init__에서 1회).
+        """
+        set_cpu_affinity({1}, "Detect worker")
+
+        face_detection = self.face_detection
+
+        # 핫루프에서 반복되는 LOAD_ATTR 제거 (locals 바인딩)
+        wait_for_frame = self.camera.wait_for_frame
+        get_frame_pair = self.camera.get_frame_pair
+        should_detect = self._should_detect
+        detect_faces = self._detect_roi_or_full
+        detect_queue = self.detect_queue
+
+        while self.running:
+            if self.current_mode != 'ai_tracking':
+                time.sleep(1.0)
+                continue
+
+            # 새 프레임 이벤트 대기 (1ms 폴링 제거 + 같은 프레임 재처리 방지)
+            if not wait_for_frame(timeout=0.5):
+                continue
+
+            # 1. 원본(1920x1080) + 감지용 축소(320x180) 프레임 쌍 가져오기
+            #    축소는 카메라 프로세스에서 이미 끝남 -> 여기선 전처리 패스 없음
+            frame, frame_small = get_frame_pair()
+            if frame is None:
+                continue
+
+            # frame = cv2.rotate(frame, cv2.ROTATE_180)
+
+            current_time = time.monotonic_ns()
+
+            # 3. 모션 게이트: 장면 변화가 작으면 MediaPipe 호출을 건너뛰고
+            #    직전 감지 결과를 재사용 (트래커 타임아웃은 계속 동작함)
+            if should_detect(frame_small):
+                # 얼굴 감지 수행 (NMS 적용됨) -> 결과는 1920x1080 좌표로 환산되어 나옴
+                detected_positions = detect_faces(frame_small, face_detection)
+                self._prev_detected = detected_positions
+                self._frames_since_detect = 0
+                self._detect_count += 1
+            else:
+                detected_positions = self._prev_detected
+                self._frames_since_detect += 1
+            self._frame_count += 1
+
+            # 큐가 차 있으면 오래된 결과를 버려서 지연 상한 유지 (drop-oldest)
+            if detect_queue.full():
+                try: detect_queue.get_nowait()
+                except queue.Empty: pass
+            detect_queue.put((frame, detected_positions, current_time))
+
     def run(self):
         print("[AI] Service Started (Auto-Rotate 180)")
+
+        # 메인 루프 코어 고정 + 실시간 우선순위 (4Hz 발행 지터 감소)
+        set_cpu_affinity({3}, "Main loop")
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+            print("[AI] Main loop: SCHED_FIFO(20)")
+        except (AttributeError, PermissionError, OSError):
+            pass  # CAP_SYS_NICE 없으면 기본 스케줄러로 동작
+
         self.camera.start()
-        
-        # 전송 주기 (4Hz)
-        target_send_interval = 0.25
+        self.running = True
 
-        # 감지 설정 (model_selection=1: 원거리/전신용이 1920 해상도에서 더 적합할 수 있음)
-        # 상황에 따라 0으로 변경 가능
-        with mp.solutions.face_detection.FaceDetection(
-            model_selection=1, 
-            min_detection_confidence=0.5 
-        ) as face_detection:
-            
-            last_global_identify_time = 0
-            
-            try:
-                while True:
-                    if self.current_mode != 'ai_tracking':
-                        time.sleep(1.0)
-                        continue
-                    
-                    # 1. 원본 프레임 가져오기 (1920x1080)
-                    frame = self.camera.get_frame()
-                    if frame is None:
-                        time.sleep(0.001)
-                        continue
-                    
-                    # frame = cv2.rotate(frame, cv2.ROTATE_180)
-                    
-                    current_time = time.time()
-                    
-                    # 2. 감지용 리사이즈 (640x360) - 16:9 비율 유지
-                    frame_small = cv2.resize(frame, 
-                        (self.config.PROCESSING_WIDTH, self.config.PROCESSING_HEIGHT))
-                    
-                    # 3. 얼굴 감지 수행 (NMS 적용됨) -> 결과는 1920x1080 좌표로 환산되어 나옴
-                    detected_positions = self._detect_faces(frame_small, face_detection)
-                    
-                    # 4. 트래커 업데이트 (FHD 좌표 기준)
-                    updated_ids, lost_faces = self.tracker.update(detected_positions, current_time)
-                
-                    # 5. 얼굴 신원 확인 (회전된 원본 FHD 프레임 사용 -> 인식률 최상)
-                    force_identify = (current_time - last_global_identify_time >= self.config.FACE_ID_INTERVAL)
-                    newly_identified = self.tracker.identify_faces(
-                        self.recognizer, 
-                        frame,
-                        current_time,
-                        interval=self.config.FACE_ID_INTERVAL,
-                        force_all=force_identify
-                    )
-                    
-                    if force_identify: last_global_identify_time = current_time
-                    
-                    for _, user_id, confidence in newly_identified:
-                        self.mqtt.publish_face_detected(user_id, confidence)
-                    
-                    # 6. 좌표 전송 (4Hz)
-                    if current_time - self.last_position_time >= target_send_interval:
-                        session_id, selected_users = self.mqtt.get_current_session()
-                        tracked_faces = self.tracker.get_selected_faces(selected_users)
-                        
-                        unique_users = {}
-                        for finfo in tracked_faces:
-                            # 유령 좌표 방지 (0.3초 컷)
-                            if current_time - finfo['last_seen'] < 0.3:
-                                unique_users[finfo['user_id']] = finfo
-                        
-                        for user_id, finfo in unique_users.items():
-                            x, y = finfo['center']
-                            self.mqtt.publish_face_position(user_id, x, y)
-                        
-                        self.last_position_time = current_time
-                    
-                    for lost_info in lost_faces:
-                        self.mqtt.publish_face_lost(lost_info['user_id'], lost_info['duration'])
-                    
-                    time.sleep(0.001)
-            
-            except KeyboardInterrupt:
-                pass
-            finally:
-                self.camera.stop()
-                self.mqtt.stop()
-
-    def _detect_faces(self, frame_processing, face_detection):
-        # MediaPipe는 RGB 이미지를 원함
-        rgb = cv2.cvtColor(frame_processing, cv2.COLOR_BGR2RGB)
-        results = face_detection.process(rgb)
+        # 전송 주기 (4Hz) - monotonic_ns 정수 비교
+        target_send_interval = 250_000_000
+
+        # 감지 스레드 분리 -> 다음 프레임 감지와 인식/전송이 겹쳐서 수행됨 (파이프라이닝)
+        threading.Thread(target=self._detect_worker, daemon=True).start()
+
+        # FPS 리포터: 카운터 델타만 1초마다 읽음 (핫루프에 분기/모듈로/print 없음)
+        threading.Thread(target=self._fps_reporter, daemon=True).start()
+
+        last_global_identify_time = 0
+
+        # 핫루프 locals 바인딩 (반복 LOAD_ATTR 제거)
+        detect_queue_get = self.detect_queue.get
+        tracker_update = self.tracker.update
+        identify_faces = self.tracker.identify_faces
+        publish_detected = self.mqtt.publish_face_detected
+        publish_positions = self.mqtt.publish_face_positions
+        publish_lost = self.mqtt.publish_face_lost
+        get_current_session = self.mqtt.get_current_session
+        get_selected_faces = self.tracker.get_selected_faces
+        recognizer = self.recognizer
+        face_id_interval = int(self.config.FACE_ID_INTERVAL * 1e9)  # ns
+        last_position_time = self.last_position_time
+
+        try:
+            while True:
+                # 감지 결과 대기 (타임아웃으로 종료/모드 변경에 반응)
+                try:
+                    frame, detected_positions, current_time = detect_queue_get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                # 4. 트래커 업데이트 (FHD 좌표 기준)
+                updated_ids, lost_faces = tracker_update(detected_positions, current_time)
+
+                # 5. 얼굴 신원 확인 (회전된 원본 FHD 프레임 사용 -> 인식률 최상)
+                force_identify = (current_time - last_global_identify_time >= face_id_interval)
+                newly_identified = identify_faces(
+                    recognizer,
+                    frame,
+                    current_time,
+                    interval=face_id_interval,
+                    force_all=force_identify
+                )
+
+                if force_identify: last_global_identify_time = current_time
+
+                for _, user_id, confidence in newly_identified:
+                    publish_detected(user_id, confidence)
+
+                # 6. 좌표 전송 (4Hz)
+                if current_time - last_position_time >= target_send_interval:
+                    session_id, selected_users = get_current_session()
+                    # 유령 좌표(0.3초 경과) 필터는 트래커 내부에서 수행됨
+                    fresh_faces = get_selected_faces(selected_users, now=current_time)
+
+                    # 얼굴 N개 좌표를 MQTT 메시지 1건으로 묶어 발행
+                    publish_positions([
+                        (user_id, finfo['center'][0], finfo['center'][1])
+                        for user_id, finfo in fresh_faces.items()
+                    ])
+
+                    last_position_time = current_time
+
+                for lost_info in lost_faces:
+                    publish_lost(lost_info['user_id'], lost_info['duration'])
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            self.face_detection.close()
+            self.camera.stop()
+            self.mqtt.stop()
+
+    def _fps_reporter(self):
+        """1초 주기로 FPS와 감지 스킵율 출력 (핫루프 밖 저우선순위 스레드)"""
+        last_frames = 0
+        last_detects = 0
+        while self.running:
+            time.sleep(1.0)
+            frames = self._frame_count
+            detects = self._detect_count
+            delta = frames - last_frames
+            if delta and self.current_mode == 'ai_tracking':
+                print(f"[AI] FPS: {delta} | detect {detects - last_detects}/{delta}")
+            last_frames, last_detects = frames, detects
+
+    def _detect_roi_or_full(self, frame_small, face_detection):
+        """추적 중이면 얼굴 주변 ROI만 감지, 주기적으로 전체 프레임 재탐색"""
+        self._roi_frame_count += 1
+        tracked = self.tracker.get_bboxes()
+        if (not tracked
+                or self._roi_frame_count % self.config.ROI_REDETECT_INTERVAL == 0):
+            return self._detect_faces(frame_small, face_detection)
+
+        h, w = frame_small.shape[:2]
+        sx = w / self.config.CAMERA_WIDTH
+        sy = h / self.config.CAMERA_HEIGHT
+
+        # 추적 박스 합집합 + 최대 얼굴 크기만큼 패딩 (감지 좌표계)
+        x1 = min(b[0] for b in tracked) * sx
+        y1 = min(b[1] for b in tracked) * sy
+        x2 = max(b[2] for b in tracked) * sx
+        y2 = max(b[3] for b in tracked) * sy
+        pad = max(max(b[2] - b[0] for b in tracked) * sx,
+                  max(b[3] - b[1] for b in tracked) * sy)
+        x0 = max(0, int(x1 - pad)); y0 = max(0, int(y1 - pad))
+        x3 = min(w, int(x2 + pad)); y3 = min(h, int(y2 + pad))
+        if x3 - x0 < 16 or y3 - y0 < 16:
+            return self._detect_faces(frame_small, face_detection)
+
+        # MediaPipe는 연속 메모리만 받으므로 ROI는 복사 (그래도 전체보다 훨씬 작음)
+        roi = np.ascontiguousarray(frame_small[y0:y3, x0:x3])
+        detected = self._detect_faces(roi, face_detection, origin=(x0, y0, w, h))
+
+        # ROI가 추적 중인 얼굴을 놓치면 전체 프레임으로 폴백
+        if len(detected) < len(tracked):
+            return self._detect_faces(frame_small, face_detection)
+        return detected
+
+    def _should_detect(self, frame_small):
+        """모션 점수(32x32 그레이 diff 합)로 감지 실행 여부 결정
+
+        모든 중간 결과는 사전 할당 버퍼(dst=)에 기록 -> 프레임당 할당 0회
+        """
+        cv2.resize(frame_small, (32, 32), dst=self._gate_small,
+                   interpolation=cv2.INTER_NEAREST)
+        cv2.cvtColor(self._gate_small, cv2.COLOR_RGB2GRAY, dst=self._gate_gray)
+
+        run_detect = True
+        if (self._motion_prev is not None
+                and self._frames_since_detect < self.config.MOTION_MAX_SKIP):
+            # cv2.norm L1 == |diff| 합을 한 번의 C 호출로 (중간 diff 버퍼 불필요)
+            score = cv2.norm(self._gate_gray, self._motion_prev, cv2.NORM_L1)
+            if score < self.config.MOTION_GATE_THRESH:
+                run_detect = False
+
+        # 이전 프레임 보관용 버퍼는 더블 버퍼링으로 교체 (복사 1회만)
+        if self._motion_prev is None:
+            self._motion_prev = self._gate_gray.copy()
+        else:
+            np.copyto(self._motion_prev, self._gate_gray)
+        return run_detect
+
+    def _detect_faces(self, frame_processing, face_detection, origin=None):
+        # 카메라가 RGB로 디코딩해 주므로 변환 없이 바로 투입
+        results = face_detection.process(frame_processing)
         
         detected = []
         if results.detections:
-            boxes = []
-            scores = []
-            raw_detections = []
-            
-            # frame_processing은 640x360
-            h_small, w_small, _ = frame_processing.shape
-
-            for detection in results.detections:
-                score = detection.score[0]
-                bbox = detection.location_data.relative_bounding_box
-                
-                # NMS 계산용 (작은 화면 좌표)
-                x1 = int(bbox.xmin * w_small)
-                y1 = int(bbox.ymin * h_small)
-                x2 = int((bbox.xmin + bbox.width) * w_small)
-                y2 = int((bbox.ymin + bbox.height) * h_small)
-                
-                boxes.append([x1, y1, x2, y2])
-                scores.append(score)
-                raw_detections.append(bbox)
-
-            if len(boxes) > 0:
-                # NMS 실행
-                picked_indices = non_max_suppression(np.array(boxes), np.array(scores), overlap_thresh=0.3)
-
-                for i in picked_indices:
-                    bbox_raw = raw_detections[i]
-                    
-                    # ✅ [핵심 변환] 상대좌표(0.0~1.0) * 원본해상도(1920x1080)
-                    orig_w = self.config.CAMERA_WIDTH
-                    orig_h = self.config.CAMERA_HEIGHT
-                    
-                    x_center = int((bbox_raw.xmin + bbox_raw.width / 2) * orig_w)
-                    y_center = int((bbox_raw.ymin + bbox_raw.height / 2) * orig_h)
-                    
-                    x1_orig = int(bbox_raw.xmin * orig_w)
-                    y1_orig = int(bbox_raw.ymin * orig_h)
-                    x2_orig = int((bbox_raw.xmin + bbox_raw.width) * orig_w)
-                    y2_orig = int((bbox_raw.ymin + bbox_raw.height) * orig_h)
+            # (N,4) [xmin, ymin, width, height] 상대좌표를 일괄 수집
+            raw = np.fromiter(
+                (v for d in results.detections
+                 for b in (d.location_data.relative_bounding_box,)
+                 for v in (b.xmin, b.ymin, b.width, b.height)),
+                dtype=np.float32,
+            ).reshape(-1, 4)
+            scores = np.fromiter(
+                (d.score[0] for d in results.detections), dtype=np.float32)
+
+            # [x1, y1, x2, y2] 상대좌표로 변환 (한 번의 배열 연산)
+            rel = np.empty_like(raw)
+            rel[:, 0:2] = raw[:, 0:2]
+            rel[:, 2:4] = raw[:, 0:2] + raw[:, 2:4]
+
+            if origin is not None:
+                # ROI 상대좌표 -> 전체 감지 프레임 상대좌표로 환산
+                x0, y0, fw, fh = origin
+                rh, rw = frame_processing.shape[:2]
+                rel[:, 0::2] = (rel[:, 0::2] * rw + x0) / fw
+                rel[:, 1::2] = (rel[:, 1::2] * rh + y0) / fh
 
+            # NMS는 정규화 좌표에서 바로 수행 (픽셀 투영은 생존 박스만)
+            picked_indices = non_max_suppression(rel, scores, overlap_thresh=0.3)
+
+            if len(picked_indices) > 0:
+                # ✅ [핵심 변환] 상대좌표(0.0~1.0) * 원본해상도(1920x1080) - 일괄 계산
+                boxes_fhd = (rel[picked_indices] * self._proj_fhd).astype(np.int32)
+                centers = (boxes_fhd[:, 0:2] + boxes_fhd[:, 2:4]) // 2
+
+                for (x1, y1, x2, y2), (cx, cy) in zip(boxes_fhd.tolist(), centers.tolist()):
                     detected.append({
-                        'center': (x_center, y_center),
-                        'bbox': (x1_orig, y1_orig, x2_orig, y2_orig) # 원본 FHD 좌표
+                        'center': (cx, cy),
+                        'bbox': (x1, y1, x2, y2) # 원본 FHD 좌표
                     })
-        
+
         return detected
 
 def main():
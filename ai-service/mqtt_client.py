@@ -1,10 +1,28 @@
 # ai-service/mqtt_client.py
 
 import json
+import queue
+import socket
 import threading
+import time
 from datetime import datetime
 import paho.mqtt.client as mqtt
 
+# orjson이 있으면 C 인코더 사용 (bytes 반환 -> paho에 그대로 전달, decode 불필요)
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _dumps = lambda o: json.dumps(o).encode()
+    _loads = json.loads  # bytes 직접 수용
+
+# 발행 토픽 상수 (발행 지점마다 리터럴 반복 대신 단일 정의)
+TOPIC_FACE_DETECTED = "ambient/ai/face-detected"
+TOPIC_FACE_POSITION = "ambient/ai/face-position"
+TOPIC_FACE_LOST = "ambient/ai/face-lost"
+TOPIC_SESSION_REQUEST = "ambient/session/request"
+
 class MQTTClient:
     def __init__(self, broker, port):
         self.client = mqtt.Client(
@@ -12,10 +30,14 @@ class MQTTClient:
             client_id="ai-service"
         )
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self._connected = False
         
         self.current_session_id = None
-        self.selected_user_ids = []
+        self.selected_user_ids = frozenset()
+        # (session_id, frozenset(user_ids)) 불변 스냅샷 - 핫루프에서 락 없이 읽음
+        self._session_cache = (None, frozenset())
         self.lock = threading.Lock()
         
         # 콜백 초기화
@@ -23,13 +45,69 @@ class MQTTClient:
         self.on_user_register = None
         self.on_user_update = None
         self.on_mode_change = None 
+
+        # 토픽 -> 핸들러 점프 테이블 (if/elif 체인 및 무관 토픽 파싱 제거)
+        self._dispatch = {
+            "ambient/command/mode": self._handle_mode,
+            "ambient/session/active": self._handle_session,
+            "ambient/user/select": self._handle_session,
+            "ambient/user/register": self._handle_register,
+            "ambient/user/update": self._handle_user_update,
+        }
         
+        # 발행 전용 큐 + writer 스레드: 브로커/네트워크 지연이
+        # AI 루프(감지 케이던스)로 전파되지 않도록 분리
+        self._pub_queue = queue.Queue(maxsize=64)
+        self._dropped = 0
+        # ISO 타임스탬프 캐시: 같은 틱(1ms) 안의 publish들은 포맷 1회 공유
+        self._ts_cache = (0.0, "")
+        # 사용자별 마지막 송신 좌표 (1px 이내 변화는 재송신 생략)
+        self._last_pos = {}
+        threading.Thread(target=self._publish_drain, daemon=True).start()
+
+        # 좌표 버스트가 인플라이트 제한에 걸려 밀리지 않도록 상향
+        self.client.max_inflight_messages_set(50)
+
         self.client.connect(broker, port, 60)
         self.client.loop_start()
         print(f"[MQTT] Connected: {broker}:{port}")
 
+    def _publish_drain(self):
+        while True:
+            topic, payload, qos = self._pub_queue.get()
+            try:
+                self.client.publish(topic, payload, qos=qos)
+            except Exception as e:
+                print(f"[MQTT] Publish error: {e}")
+
+    def _now_iso(self):
+        t = time.time()
+        cached_t, cached_s = self._ts_cache
+        if t - cached_t >= 0.001:
+            cached_s = datetime.fromtimestamp(t).isoformat()
+            self._ts_cache = (t, cached_s)
+        return cached_s
+
+    def _enqueue_publish(self, topic, payload, qos):
+        # 세션 없음/미연결 상태에서는 어차피 버려질 메시지 -> 큐에 넣지 않음
+        if not self._connected:
+            return
+        try:
+            self._pub_queue.put_nowait((topic, payload, qos))
+        except queue.Full:
+            # 좌표류는 최신값(latest-value) 의미라 드롭이 올바른 동작
+            self._dropped += 1
+            if self._dropped % 100 == 1:
+                print(f"[MQTT] Publish queue full (dropped={self._dropped})")
+
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code != 0: return
+        self._connected = True
+        # Nagle 비활성화: ~100바이트 좌표 패킷이 병합 대기로 묶이지 않게 즉시 송신
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
         topics = [
             "ambient/user/register",
             "ambient/user/update",   
@@ -40,64 +118,111 @@ class MQTTClient:
         for topic in topics: client.subscribe(topic)
         self._request_active_session()
 
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self._connected = False
+
     def _request_active_session(self):
         payload = {"requester": "ai-service", "timestamp": datetime.now().isoformat()}
-        self.client.publish("ambient/session/request", json.dumps(payload), qos=1)
+        self.client.publish(TOPIC_SESSION_REQUEST, _dumps(payload), qos=1)
 
     def _on_message(self, client, userdata, msg):
         try:
-            payload = json.loads(msg.payload.decode())
-            
-            if msg.topic == "ambient/command/mode":
-                cmd_type = payload.get("type", "motor")
-                
-                if cmd_type != "motor":
-                    return 
-
-                if self.on_mode_change:
-                    self.on_mode_change(payload.get('mode'))
-
-            elif msg.topic == "ambient/session/active":
-                session_id = payload.get('session_id')
-                user_list = payload.get('user_list', [])
-                with self.lock:
-                    self.current_session_id = session_id
-                    self.selected_user_ids = [u['user_id'] for u in user_list]
-                if self.on_session_update:
-                    self.on_session_update(session_id, self.selected_user_ids)
-            
-            elif msg.topic == "ambient/user/select":
-                session_id = payload.get('session_id')
-                user_list = payload.get('user_list', [])
-                with self.lock:
-                    self.current_session_id = session_id
-                    self.selected_user_ids = [u['user_id'] for u in user_list]
-                if self.on_session_update:
-                    self.on_session_update(session_id, self.selected_user_ids)
-            
-            elif msg.topic == "ambient/user/register":
-                if self.on_user_register: self.on_user_register(payload)
-            
-            elif msg.topic == "ambient/user/update":
-                if self.on_user_update: self.on_user_update(payload)
-                    
+            handler = self._dispatch.get(msg.topic)
+            if handler is None:
+                return
+
+            # 모드 토픽: motor 타입이 아니면 JSON 파싱 전에 바이트 검사로 탈락
+            if (handler is self._handle_mode
+                    and b'"type"' in msg.payload
+                    and b'"motor"' not in msg.payload):
+                return
+
+            handler(_loads(msg.payload))
         except Exception as e:
             print(f"[MQTT] Error: {e}")
 
+    def _handle_mode(self, payload):
+        if payload.get("type", "motor") != "motor":
+            return
+        if self.on_mode_change:
+            self.on_mode_change(payload.get('mode'))
+
+    def _handle_session(self, payload):
+        session_id = payload.get('session_id')
+        user_list = payload.get('user_list', [])
+        with self.lock:
+            self.current_session_id = session_id
+            # frozenset: O(1) 멤버십 + 불변이라 복사 없이 공유 가능
+            self.selected_user_ids = frozenset(u['user_id'] for u in user_list)
+            self._session_cache = (session_id, self.selected_user_ids)
+        if self.on_session_update:
+            self.on_session_update(session_id, self.selected_user_ids)
+
+    def _handle_register(self, payload):
+        if self.on_user_register: self.on_user_register(payload)
+
+    def _handle_user_update(self, payload):
+        if self.on_user_update: self.on_user_update(payload)
+
     def get_current_session(self):
-        with self.lock: return self.current_session_id, self.selected_user_ids.copy()
+        # 불변 튜플 참조 반환 - 락/복사 불필요 (갱신은 _on_message에서 원자적 교체)
+        return self._session_cache
 
     def publish_face_detected(self, user_id, confidence):
-        payload = {"user_id": user_id, "confidence": float(confidence), "timestamp": datetime.now().isoformat()}
-        self.client.publish("ambient/ai/face-detected", json.dumps(payload), qos=1)
+        # 활성 세션이 없으면 페이로드를 만들기 전에 탈출 (유휴 구간 할당 제거)
+        if self._session_cache[0] is None:
+            return
+        payload = {"user_id": user_id, "confidence": float(confidence), "timestamp": self._now_iso()}
+        self._enqueue_publish(TOPIC_FACE_DETECTED, _dumps(payload), qos=1)
 
     def publish_face_position(self, user_id, x, y):
-        payload = {"user_id": user_id, "x": x, "y": y, "timestamp": datetime.now().isoformat()}
-        self.client.publish("ambient/ai/face-position", json.dumps(payload), qos=0)
+        payload = {"user_id": user_id, "x": x, "y": y, "timestamp": self._now_iso()}
+        self._enqueue_publish(TOPIC_FACE_POSITION, _dumps(payload), qos=0)
+
+    # 좌표 페이로드는 구조가 고정이라 dict 생성 + json.dumps 순회 대신
+    # 문자열 템플릿으로 직접 조립 (4Hz x N 얼굴 핫패스)
+    _POS_SINGLE = '{{"user_id":{uid},"x":{x},"y":{y},"timestamp":{ts}}}'
+    _POS_ENTRY = '{{"user_id":{uid},"x":{x},"y":{y}}}'
+
+    def publish_face_positions(self, positions):
+        """프레임당 좌표 N건을 1건의 MQTT 메시지로 묶어 발행
+
+        positions: [(user_id, x, y), ...]
+        단일 얼굴이면 기존 단건 포맷을 유지하고, 복수면 positions 배열로 묶음.
+        """
+        if not positions or self._session_cache[0] is None:
+            return
+        # 전원이 사실상 정지 상태면 패킷 자체를 생략 (최신값 의미라 무손실)
+        # 기준점은 "마지막으로 발행한" 좌표 -> 생략된 틱의 미세 이동이 누적되어
+        # 임계값을 넘으면 발행됨 (생략할 때 기준점을 갱신하면 느린 이동이 영원히 묻힘)
+        last_pos = self._last_pos
+        moved = False
+        for u, x, y in positions:
+            prev = last_pos.get(u)
+            if prev is None or abs(x - prev[0]) > 1 or abs(y - prev[1]) > 1:
+                moved = True
+                break
+        if not moved:
+            return
+        for u, x, y in positions:
+            last_pos[u] = (x, y)
+        ts = json.dumps(self._now_iso())
+        if len(positions) == 1:
+            user_id, x, y = positions[0]
+            payload = self._POS_SINGLE.format(
+                uid=json.dumps(user_id), x=int(x), y=int(y), ts=ts)
+        else:
+            entries = ",".join(
+                self._POS_ENTRY.format(uid=json.dumps(u), x=int(x), y=int(y))
+                for u, x, y in positions)
+            payload = '{"positions":[' + entries + '],"timestamp":' + ts + '}'
+        self._enqueue_publish(TOPIC_FACE_POSITION, payload, qos=0)
 
     def publish_face_lost(self, user_id, duration):
-        payload = {"user_id": user_id, "duration_seconds": duration, "timestamp": datetime.now().isoformat()}
-        self.client.publish("ambient/ai/face-lost", json.dumps(payload), qos=1)
+        if self._session_cache[0] is None:
+            return
+        payload = {"user_id": user_id, "duration_seconds": duration, "timestamp": self._now_iso()}
+        self._enqueue_publish(TOPIC_FACE_LOST, _dumps(payload), qos=1)
 
     def stop(self):
         self.client.loop_stop()
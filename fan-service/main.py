@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
+import os
 import signal
 import time
 import sys
 import threading
 from config import Config
+
+# 수신 메시지 전체 덤프는 4Hz 좌표 토픽에서 프레임마다 f-string 포맷 비용을
+# 유발하므로 기본 꺼짐 (FAN_VERBOSE=1 로 켬)
+VERBOSE = int(os.environ.get("FAN_VERBOSE", "0"))
 from hardware import FanHardware
 from mqtt_client import FanMQTTClient
 
@@ -19,11 +24,19 @@ class FanService:
         self.is_natural_wind = False          # 오직 wind type에 의해서만 변경됨
         
         self.shutdown_timer = None
+
+        # 트래킹 좌표는 최신값만 의미 있음: 수신 스레드는 최신 목표만 갈아끼우고
+        # UART 송신은 전용 워커가 수행 (시리얼 지연이 MQTT 수신을 막지 않음)
+        self._track_lock = threading.Lock()
+        self._latest_positions = {}
+        self._track_event = threading.Event()
+
         self.hw = FanHardware(config, self.on_arduino_status)
         self.mqtt = FanMQTTClient(config, self.handle_mqtt_message)
+        threading.Thread(target=self._tracking_worker, daemon=True).start()
     
     def handle_mqtt_message(self, topic: str, payload: dict):
-        print(f"[MQTT] 📥 {topic}: {payload}")
+        if VERBOSE: print(f"[MQTT] 📥 {topic}: {payload}")
         
         if topic == "ambient/command/mode":
             cmd_type = payload.get("type", "motor") 
@@ -86,22 +99,45 @@ class FanService:
         elif topic == "ambient/ai/face-position":
             # [중요] AI 트래킹 모드일 때만 좌표 명령 수행
             if self.movement_mode == "ai_tracking":
-                user_id = payload.get("user_id")
-                x = payload.get("x")
-                y = payload.get("y")
-                if user_id and x is not None and y is not None:
-                    if (
-                        user_id not in self.last_sent_positions or
-                        self.last_sent_positions[user_id] != (x, y)
-                    ):
-                        self.hw.send_command(f"P ({x},{y})")
-                        self.last_sent_positions[user_id] = (x, y)
+                # AI가 얼굴 N개를 positions 배열 1건으로 묶어 보냄 (단건 포맷도 지원)
+                entries = payload.get("positions") or [payload]
+                with self._track_lock:
+                    for entry in entries:
+                        user_id = entry.get("user_id")
+                        x = entry.get("x")
+                        y = entry.get("y")
+                        if user_id and x is not None and y is not None:
+                            # 같은 사용자의 이전 목표는 덮어씀 (latest-wins)
+                            self._latest_positions[user_id] = (x, y)
+                self._track_event.set()
 
         elif topic == "ambient/ai/face-lost":
             user_id = payload.get("user_id")
             if user_id in self.last_sent_positions:
                 del self.last_sent_positions[user_id]
 
+    def _tracking_worker(self):
+        """최신 좌표만 UART로 송신 (밀린 목표는 자연스럽게 폐기됨)"""
+        # 트래킹 명령 지연에 민감 -> 가능하면 실시간 우선순위 (권한 없으면 무시)
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(10))
+            print("[FAN] Tracking worker: SCHED_FIFO(10)")
+        except (AttributeError, PermissionError, OSError):
+            pass
+        while self.running:
+            if not self._track_event.wait(timeout=0.5):
+                continue
+            self._track_event.clear()
+            with self._track_lock:
+                targets = list(self._latest_positions.items())
+                self._latest_positions.clear()
+            if self.movement_mode != "ai_tracking":
+                continue
+            for user_id, (x, y) in targets:
+                if self.last_sent_positions.get(user_id) != (x, y):
+                    self.hw.send_command(f"P ({x},{y})")
+                    self.last_sent_positions[user_id] = (x, y)
+
     def _handle_timer(self, payload):
         try:
             duration_sec = float(payload.get("duration_sec", 0))
@@ -1,9 +1,33 @@
 import json
+import queue
 import socket
+import threading
 import time
 import paho.mqtt.client as mqtt
 from datetime import datetime
 
+# orjson이 있으면 사용 (bytes 직접 파싱 -> decode 중간 문자열 제거)
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads  # bytes 직접 수용
+
+TOPIC_STATUS = "ambient/fan/status"
+
+# 상태 페이로드는 구조 고정 -> dict + json.dumps 대신 문자열 템플릿으로 조립
+_STATUS_TMPL = '{{"speed":{},"timestamp":"{}"}}'
+
+# ISO 타임스탬프 캐시 (같은 버스트 안의 발행은 포맷 1회 공유)
+_ts_cache = [0.0, ""]
+
+def _now_iso():
+    t = time.time()
+    if t - _ts_cache[0] >= 0.001:
+        _ts_cache[0] = t
+        _ts_cache[1] = datetime.fromtimestamp(t).isoformat()
+    return _ts_cache[1]
+
 def wait_for_network(host, port, timeout=60):
     print(f"[NETWORK] Waiting for {host}:{port}...")
     start_time = time.time()
@@ -33,7 +57,12 @@ class FanMQTTClient:
         )
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
-        
+
+        # 발행은 전용 스레드로 분리: 브로커가 느릴 때 publish가 시리얼
+        # 읽기 스레드(상태 콜백 발원지)를 막지 않음
+        self._pub_q = queue.SimpleQueue()
+        threading.Thread(target=self._pub_worker, daemon=True).start()
+
         if not wait_for_network(self.config.MQTT_BROKER, self.config.MQTT_PORT, timeout=30):
             raise ConnectionError("Cannot reach MQTT broker")
         
@@ -55,8 +84,24 @@ class FanMQTTClient:
                 time.sleep(5)
         raise ConnectionError("Failed to connect to MQTT broker")
     
+    def _pub_worker(self):
+        while True:
+            item = self._pub_q.get()
+            if item is None:
+                break
+            topic, payload, qos = item
+            try:
+                self.client.publish(topic, payload, qos=qos)
+            except Exception as e:
+                print(f"[MQTT] Publish error: {e}")
+
     def on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
+            # Nagle 비활성화: 소형 명령/상태 패킷의 병합 대기 제거
+            try:
+                client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (OSError, AttributeError):
+                pass
             topics = [
                 "ambient/command/#",
                 "ambient/ai/face-position",
@@ -70,24 +115,18 @@ class FanMQTTClient:
     
     def on_message(self, client, userdata, msg):
         try:
-            payload = json.loads(msg.payload.decode("utf-8"))
+            payload = _loads(msg.payload)
             self.message_handler(msg.topic, payload)
         except Exception as e:
             print(f"[MQTT] Message error: {e}")
     
     # 아직 구현 X . UART tx로 현재 상태 받아와서 status 발행
     def publish_status(self, speed_level: int):
-        topic = "ambient/fan/status"
-        payload = {
-            "speed": speed_level,
-            "timestamp": datetime.now().isoformat()
-        }
-        try:
-            self.client.publish(topic, json.dumps(payload), qos=1)
-            print(f"[MQTT] Status published: speed={speed_level}")
-        except Exception as e:
-            print(f"[MQTT] Publish error: {e}")
+        payload = _STATUS_TMPL.format(int(speed_level), _now_iso())
+        self._pub_q.put((TOPIC_STATUS, payload, 1))
+        print(f"[MQTT] Status published: speed={speed_level}")
     
     def disconnect(self):
+        self._pub_q.put(None)  # 퍼블리셔 스레드 종료 센티널
         self.client.loop_stop()
         self.client.disconnect()